@@ -9,6 +9,7 @@ Core functions:
     getwcs_dem(): download the data as geotiff file for given bbox and resolution
     dem2slope(): convert geotiff to slope raster
     dem2aspect(): convert geotiff to aspect raster
+    dem2slope_aspect(): convert geotiff to slope and aspect rasters in a single pass
     getdict_license(): get the license and attributes for the DEM 1 arc second grid
 
 The DEM layer metadata can be retrieved with the function get_capabilities().
@@ -16,6 +17,10 @@ and the respective licensing and attribution are availabe with the module functi
 
 To download the DEM data, the function getwcs_dem() is used.
 
+WCS capabilities and the HTTP session are cached at module level.
+When called from R, reticulate keeps this module imported in the embedded Python session,
+so these caches stay warm across calls without the need for a separate worker process.
+
 For more details about the data, see:
 https://ecat.ga.gov.au/geonetwork/srv/eng/catalog.search#/metadata/72759
 
@@ -31,13 +36,27 @@ This open-source software is released under the LGPL-3.0 License.
 Author: Sebastian Haan
 """
 
+import functools
+import hashlib
+import json
 import logging
 import os
+import shutil
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 import utils
 from utils import spin
 
+import numpy as np
 import rasterio
+import requests
+from numba import njit
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from arc2meter import calc_arc2meter
 
 # logger setup
 import write_logs
@@ -51,6 +70,29 @@ except ImportError:
     import gdal
 
 
+# WCS url of the Geoscience Australia DEM 1 arc second grid
+_DEFAULT_DEM_URL = "https://services.ga.gov.au/site_9/services/DEM_SRTM_1Second_Hydro_Enforced/MapServer/WCSServer?request=GetCapabilities&service=WCS"
+
+# nodata value of slope and aspect rasters (same as gdaldem)
+_NODATA = -9999.0
+
+# transient download errors which are retried, HTTP errors only for status 5xx
+_RETRY_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.HTTPError,
+    socket.timeout,
+)
+
+# HTTP session shared by all downloads, keeps connections to the WCS server alive
+# so concurrent tile requests do not each pay a new TCP and TLS handshake
+_SESSION = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+_SESSION.mount("https://", _adapter)
+_SESSION.mount("http://", _adapter)
+
+
 def get_demdict():
     """
     Get dictionary of meta data
@@ -96,7 +138,567 @@ def getdict_license():
     return dict
 
 
-def get_capabilities(url):
+@functools.lru_cache(maxsize=8)
+def _get_wcs(url, version="1.0.0", timeout=300):
+    """
+    Create WCS object for url, cached so that repeated calls
+    do not re-fetch and re-parse the GetCapabilities document.
+    The returned object is shared, treat it as read-only.
+    """
+    return WebCoverageService(url, version=version, timeout=timeout)
+
+
+_thread_local = threading.local()
+
+
+def _get_wcs_thread(url):
+    """
+    Return WCS object owned by the current thread.
+    owslib objects are not documented as thread-safe, so each download worker
+    lazily creates its own instance.
+    """
+    wcs_dict = getattr(_thread_local, "wcs", None)
+    if wcs_dict is None:
+        wcs_dict = _thread_local.wcs = {}
+    if url not in wcs_dict:
+        wcs_dict[url] = WebCoverageService(url, version="1.0.0", timeout=300)
+    return wcs_dict[url]
+
+
+def _save_response(response, outfname, chunk_size=1 << 20):
+    """
+    Write WCS response to file in chunks.
+
+    Data is written to a temporary '.part' file which is only renamed to outfname
+    once complete, so an interrupted download does not leave a corrupt file behind
+    that would later be mistaken for a finished download.
+
+    Parameters
+    ----------
+    response : requests.Response, owslib ResponseWrapper or file-like object
+        response of the GetCoverage request
+    outfname : str
+        output file name
+    chunk_size : int
+        number of bytes per chunk (default 1 MiB)
+    """
+    fname_part = outfname + ".part"
+    try:
+        with open(fname_part, "wb") as f:
+            if hasattr(response, "iter_content"):
+                # requests.Response, ideally opened with stream=True
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+            elif hasattr(response, "_response"):
+                # owslib ResponseWrapper, read() takes no size argument
+                f.write(response.read())
+            else:
+                shutil.copyfileobj(response, f, length=chunk_size)
+        os.replace(fname_part, outfname)
+    finally:
+        if os.path.exists(fname_part):
+            os.remove(fname_part)
+
+
+def _getcoverage_direct(bbox, resolution, crs, url):
+    """
+    Request DEM coverage with a plain WCS 1.0.0 GetCoverage KVP request,
+    without fetching and parsing the capabilities document first.
+
+    Parameters
+    ----------
+    bbox : list
+        layer bounding box
+    resolution : int
+        layer resolution in arcsec
+    crs: str
+        crs of bbox and output
+    url : str
+        url of wcs server, any query string is discarded
+
+    Return
+    ------
+    Streamed requests.Response, or None if the server did not return a coverage
+    """
+    params = {
+        "service": "WCS",
+        "version": "1.0.0",
+        "request": "GetCoverage",
+        "coverage": "1",
+        "bbox": ",".join(map(str, bbox)),
+        "crs": crs,
+        "format": "GeoTIFF",
+        "resx": resolution / 3600,
+        "resy": resolution / 3600,
+        "styles": "tc",
+    }
+    response = _SESSION.get(url.split("?")[0], params=params, stream=True, timeout=300)
+    # Server errors are returned as xml ServiceException, sometimes with status 200
+    content_type = response.headers.get("Content-Type", "")
+    if response.status_code >= 500:
+        # Server error, raised as HTTPError so the request is retried
+        response.close()
+        response.raise_for_status()
+    if response.status_code != 200 or "xml" in content_type:
+        logging.info(f"Direct GetCoverage request failed ({response.status_code})")
+        response.close()
+        return None
+    return response
+
+
+def _get_tile(url, bbox, resolution, crs, outfname, wcs=None, retries=5):
+    """
+    Download DEM coverage for a single bounding box and save as geotiff.
+
+    Parameters
+    ----------
+    url : str
+        url of wcs server
+    bbox : list
+        tile bounding box
+    resolution : int
+        layer resolution in arcsec
+    crs: str
+        crs of bbox and output
+    outfname : str
+        output file name
+    wcs : WebCoverageService
+        WCS object to fall back to if the direct GetCoverage request fails,
+        default is the WCS object of the current thread
+    retries : int
+        number of download attempts before giving up (default 5),
+        waiting 1, 2, 4, ... seconds between attempts.
+        Only connection errors, timeouts and HTTP 5xx errors are retried.
+
+    Return
+    ------
+    Output filename
+    """
+    if retries < 1:
+        raise ValueError(f"retries must be at least 1, got {retries}")
+    for attempt in range(retries):
+        try:
+            data = _getcoverage_direct(bbox, resolution, crs, url)
+            if data is None:
+                # Fall back to owslib, WCS object creation fetches the capabilities
+                wcs_tile = wcs if wcs is not None else _get_wcs_thread(url)
+                data = wcs_tile.getCoverage(
+                    identifier="1",
+                    bbox=bbox,
+                    format="GeoTIFF",
+                    crs=crs,
+                    resx=resolution / 3600,
+                    resy=resolution / 3600,
+                    Styles="tc",
+                )
+            try:
+                _save_response(data, outfname)
+            finally:
+                if hasattr(data, "close"):
+                    data.close()
+            return outfname
+        except _RETRY_EXCEPTIONS as e:
+            # Client errors (4xx) are permanent, e.g. invalid bbox or crs
+            if isinstance(e, requests.exceptions.HTTPError) and (
+                e.response is None or e.response.status_code < 500
+            ):
+                raise
+            if attempt == retries - 1:
+                raise
+            logging.warning(f"Download attempt {attempt + 1} failed for {bbox}: {e}")
+            time.sleep(2**attempt)
+
+
+def _split_edges(start, end, res, n):
+    """
+    Split interval into n parts with inner edges snapped to the pixel grid
+    of a single request for the whole interval. The server fits round((end - start) / res)
+    pixels into the interval, so the grid is start + k * pixel size with the
+    pixel size adjusted accordingly (equal to res if the interval is a multiple of res).
+
+    Parameters
+    ----------
+    start, end : float
+        interval bounds
+    res : float
+        requested pixel size
+    n : int
+        number of parts, less are returned if the interval has fewer pixels
+
+    Return
+    ------
+    edges : array of edges
+    pixelsize : pixel size of the grid
+    """
+    npix = max(int(round((end - start) / res)), 1)
+    pixelsize = (end - start) / npix
+    ks = np.unique(np.round(np.linspace(0, npix, n + 1)).astype(int))
+    edges = start + ks * pixelsize
+    edges[-1] = end
+    return edges, pixelsize
+
+
+def _get_tiles(url, bbox, resolution, crs, outfname, ntiles, max_workers=8):
+    """
+    Download DEM coverage split into a grid of tiles and combine them in a VRT mosaic.
+
+    Tiles are fetched concurrently, which hides the per-request latency of the
+    WCS server for large bounding boxes. The tile edges are aligned with the
+    requested pixel grid, so the mosaic needs no resampling.
+
+    Parameters
+    ----------
+    url : str
+        url of wcs server
+    bbox : list
+        layer bounding box
+    resolution : int
+        layer resolution in arcsec
+    crs: str
+        crs of bbox and output
+    outfname : str
+        output file name, used as prefix for the tile files
+    ntiles : tuple
+        number of tiles (nx, ny) along longitude and latitude
+    max_workers : int
+        maximum number of concurrent downloads (default 8)
+
+    Return
+    ------
+    fname_vrt : file name of VRT mosaic
+    fnames_tmp : list of all created files (VRT and tiles), to be removed by the caller
+        once the VRT has been converted
+    """
+    nx, ny = ntiles
+    res = resolution / 3600
+    xs, xres = _split_edges(bbox[0], bbox[2], res, nx)
+    ys, yres = _split_edges(bbox[1], bbox[3], res, ny)
+    root = os.path.splitext(outfname)[0]
+    jobs = []
+    for ix in range(len(xs) - 1):
+        for iy in range(len(ys) - 1):
+            bbox_tile = (xs[ix], ys[iy], xs[ix + 1], ys[iy + 1])
+            fname_tile = f"{root}_tile{ix}_{iy}.tif"
+            jobs.append((bbox_tile, fname_tile))
+    fname_vrt = f"{root}_tiles.vrt"
+    fnames_tmp = [fname_vrt] + [fname_tile for _, fname_tile in jobs]
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_get_tile, url, bbox_tile, resolution, crs, fname_tile)
+                for bbox_tile, fname_tile in jobs
+            ]
+            fnames_tile = [future.result() for future in futures]
+
+        # Mosaic tiles without loading them into memory
+        ds = gdal.BuildVRT(
+            fname_vrt, fnames_tile, resolution="user", xRes=xres, yRes=yres
+        )
+        if ds is None:
+            raise RuntimeError(f"Could not build VRT mosaic {fname_vrt}")
+        ds = None
+    except BaseException:
+        for fname in fnames_tmp:
+            if os.path.exists(fname):
+                os.remove(fname)
+        raise
+    return fname_vrt, fnames_tmp
+
+
+def _dem_fname(layername, bbox, resolution, crs, url, dtype="float32"):
+    """
+    Get output file name for DEM download.
+    The name contains a hash of the request parameters, so the same request
+    always maps to the same file.
+
+    Parameters
+    ----------
+    layername : str
+        layer title
+    bbox : list
+        layer bounding box
+    resolution : int
+        layer resolution in arcsec
+    crs: str
+        crs of bbox and output
+    url : str
+        url of wcs server
+    dtype : str
+        data type of output
+
+    Return
+    ------
+    Output filename (without path)
+    """
+    key = (tuple(float(b) for b in bbox), float(resolution), crs, url, dtype)
+    key = repr(key).encode()
+    request_hash = hashlib.sha1(key).hexdigest()[:10]
+    return f"{layername.replace(' ', '_')}_{request_hash}.tif"
+
+
+def _native_dem_path(outpath, layername, bbox, crs, url, dtype="float32"):
+    """
+    Get file name for DEM downloaded at native resolution for a given bbox.
+
+    Parameters
+    ----------
+    outpath : str
+        output directory
+    layername : str
+        layer title
+    bbox : list
+        layer bounding box
+    crs: str
+        crs of bbox and output
+    url : str
+        url of wcs server
+    dtype : str
+        data type of output
+
+    Return
+    ------
+    Output filename
+    """
+    resolution = get_demdict()["resolution_arcsec"]
+    fname = _dem_fname(layername, bbox, resolution, crs, url, dtype=dtype)
+    return os.path.join(outpath, fname)
+
+
+def _is_current(fname, update_sequence):
+    """
+    Check if file exists and was downloaded for the current version of the WCS layer,
+    as recorded in its json sidecar file.
+
+    Parameters
+    ----------
+    fname : str
+        file name
+    update_sequence : str
+        updateSequence of the WCS capabilities, may be None
+
+    Return
+    ------
+    bool
+    """
+    fname_meta = os.path.splitext(fname)[0] + ".json"
+    if not (os.path.exists(fname) and os.path.exists(fname_meta)):
+        return False
+    try:
+        with open(fname_meta) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get("updateSequence") == update_sequence
+
+
+def _write_sidecar(fname, update_sequence):
+    """
+    Write json sidecar file with WCS updateSequence and download time for fname.
+
+    Parameters
+    ----------
+    fname : str
+        file name
+    update_sequence : str
+        updateSequence of the WCS capabilities, may be None
+    """
+    fname_meta = os.path.splitext(fname)[0] + ".json"
+    meta = {
+        "updateSequence": update_sequence,
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(fname_meta, "w") as f:
+        json.dump(meta, f)
+
+
+def _warp_local(src, dst, dst_crs, dst_res, bounds=None, resampling="bilinear"):
+    """
+    Reproject and resample raster locally in a single multithreaded gdal.Warp call.
+
+    Parameters
+    ----------
+    src : str
+        input file name
+    dst : str
+        output file name
+    dst_crs: str
+        output crs
+    dst_res : float
+        output resolution in units of dst_crs
+    bounds : list
+        output bounding box in dst_crs, default is the extent of src
+    resampling : str
+        gdal resampling algorithm (default 'bilinear')
+
+    Return
+    ------
+    Output filename
+    """
+    fname_part = dst + ".part"
+    try:
+        ds = gdal.Warp(
+            fname_part,
+            src,
+            format="GTiff",
+            dstSRS=dst_crs,
+            outputBounds=bounds,
+            xRes=dst_res,
+            yRes=dst_res,
+            resampleAlg=resampling,
+            multithread=True,
+            warpOptions=["NUM_THREADS=ALL_CPUS"],
+            creationOptions=["NUM_THREADS=ALL_CPUS", "COMPRESS=DEFLATE", "TILED=YES"],
+        )
+        if ds is None:
+            raise RuntimeError(f"gdal.Warp failed for {src}: {gdal.GetLastErrorMsg()}")
+        ds = None
+        os.replace(fname_part, dst)
+    finally:
+        if os.path.exists(fname_part):
+            os.remove(fname_part)
+    return dst
+
+
+def _build_overviews(fname, levels=(2, 4, 8, 16, 32)):
+    """
+    Build internal reduced-resolution overviews for faster visualisation.
+
+    Parameters
+    ----------
+    fname : str
+        raster file name
+    levels : tuple
+        overview decimation factors
+    """
+    ds = gdal.Open(fname, gdal.GA_Update)
+    ds.BuildOverviews("AVERAGE", list(levels))
+    ds = None
+
+
+def _to_int16(fname, fname_src=None):
+    """
+    Convert raster to int16, with values rounded to the nearest integer
+    and nodata set to -32768. The raster grid is unchanged.
+
+    Parameters
+    ----------
+    fname : str
+        raster file name
+    fname_src : str
+        input raster (e.g. VRT), default converts fname in place
+    """
+    if fname_src is None:
+        fname_src = fname
+    ds = gdal.Open(fname_src)
+    if ds is None:
+        raise RuntimeError(f"Could not open {fname_src}: {gdal.GetLastErrorMsg()}")
+    gt = ds.GetGeoTransform()
+    bounds = [
+        gt[0],
+        gt[3] + gt[5] * ds.RasterYSize,
+        gt[0] + gt[1] * ds.RasterXSize,
+        gt[3],
+    ]
+    ds = None
+    fname_tmp = fname + ".i16.part"
+    try:
+        # gdal.Warp (unlike gdal.Translate) maps source nodata to the new nodata value
+        ds = gdal.Warp(
+            fname_tmp,
+            fname_src,
+            format="GTiff",
+            outputBounds=bounds,
+            xRes=gt[1],
+            yRes=abs(gt[5]),
+            outputType=gdal.GDT_Int16,
+            dstNodata=-32768,
+            multithread=True,
+        )
+        if ds is None:
+            raise RuntimeError(
+                f"int16 conversion failed for {fname_src}: {gdal.GetLastErrorMsg()}"
+            )
+        ds = None
+        os.replace(fname_tmp, fname)
+    finally:
+        if os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
+
+
+def _to_cog(fname, fname_src=None):
+    """
+    Convert geotiff to Cloud-Optimized GeoTIFF (COG) with 512x512 internal
+    tiles, DEFLATE compression and overviews, so windowed reads scale with the window size.
+    Falls back to a tiled and compressed GeoTIFF with overviews if the GDAL COG driver
+    is not available (GDAL < 3.1).
+
+    Parameters
+    ----------
+    fname : str
+        raster file name
+    fname_src : str
+        input raster (e.g. VRT), default converts fname in place
+    """
+    if fname_src is None:
+        fname_src = fname
+    fname_tmp = fname + ".cog.part"
+    try:
+        if gdal.GetDriverByName("COG") is not None:
+            ds = gdal.Translate(
+                fname_tmp,
+                fname_src,
+                format="COG",
+                creationOptions=[
+                    "COMPRESS=DEFLATE",
+                    "PREDICTOR=YES",
+                    "BLOCKSIZE=512",
+                    "NUM_THREADS=ALL_CPUS",
+                ],
+            )
+            if ds is None:
+                raise RuntimeError(
+                    f"gdal.Translate failed for {fname_src}: {gdal.GetLastErrorMsg()}"
+                )
+            ds = None
+        else:
+            ds = gdal.Open(fname_src)
+            if ds is None:
+                raise RuntimeError(
+                    f"Could not open {fname_src}: {gdal.GetLastErrorMsg()}"
+                )
+            band_type = ds.GetRasterBand(1).DataType
+            ds = None
+            if band_type in [gdal.GDT_Float32, gdal.GDT_Float64]:
+                predictor = 3
+            else:
+                predictor = 2
+            ds = gdal.Translate(
+                fname_tmp,
+                fname_src,
+                format="GTiff",
+                creationOptions=[
+                    "TILED=YES",
+                    "BLOCKXSIZE=512",
+                    "BLOCKYSIZE=512",
+                    "COMPRESS=DEFLATE",
+                    f"PREDICTOR={predictor}",
+                    "NUM_THREADS=ALL_CPUS",
+                ],
+            )
+            if ds is None:
+                raise RuntimeError(
+                    f"gdal.Translate failed for {fname_src}: {gdal.GetLastErrorMsg()}"
+                )
+            ds = None
+            _build_overviews(fname_tmp)
+        os.replace(fname_tmp, fname)
+    finally:
+        if os.path.exists(fname_tmp):
+            os.remove(fname_tmp)
+
+
+def get_capabilities(url, wcs=None, verbose=False):
     """
     Get capabilities from WCS layer.
 
@@ -104,6 +706,10 @@ def get_capabilities(url):
     ----------
     url : str
         layer url
+    wcs : WebCoverageService
+        existing WCS object for url, if None it is created (default None)
+    verbose : bool
+        print layer details (default False)
 
     Returns
     -------
@@ -118,25 +724,26 @@ def get_capabilities(url):
     """
 
     # Create WCS object
-    wcs = WebCoverageService(url, version="1.0.0", timeout=300)
-
-    # Get coverages and content dict keys
-    content = wcs.contents
-    keys = content.keys()
-
-    print("Following data layers are available:")
-    title_list = []
-    description_list = []
-    bbox_list = []
-    for key in keys:
-        print(f"key: {key}")
-        print(f"title: {wcs[key].title}")
-        title_list.append(wcs[key].title)
-        print(f"{wcs[key].abstract}")
-        description_list.append(wcs[key].abstract)
-        print(f"bounding box: {wcs[key].boundingBoxWGS84}")
-        bbox_list.append(wcs[key].boundingBoxWGS84)
-        print("")
+    if wcs is None:
+        wcs = _get_wcs(url)
+
+    # Get coverages and content dict keys, look up each coverage only once
+    entries = list(wcs.contents.items())
+    keys = [key for key, _ in entries]
+    title_list = [coverage.title for _, coverage in entries]
+    description_list = [coverage.abstract for _, coverage in entries]
+    bbox_list = [coverage.boundingBoxWGS84 for _, coverage in entries]
+
+    if verbose:
+        print("Following data layers are available:")
+        for key, title, description, bbox in zip(
+            keys, title_list, description_list, bbox_list
+        ):
+            print(f"key: {key}")
+            print(f"title: {title}")
+            print(f"{description}")
+            print(f"bounding box: {bbox}")
+            print("")
 
     return keys, title_list, description_list, bbox_list
 
@@ -145,9 +752,12 @@ def getwcs_dem(
     outpath,
     bbox,
     resolution=1,
-    url="https://services.ga.gov.au/site_9/services/DEM_SRTM_1Second_Hydro_Enforced/MapServer/WCSServer?request=GetCapabilities&service=WCS",
+    url=_DEFAULT_DEM_URL,
     crs="EPSG:4326",
     verbose=False,
+    ntiles=(1, 1),
+    wcs=None,
+    dtype="float32",
 ):
     """
     Function to download and save geotiff from WCS layer.
@@ -166,6 +776,21 @@ def getwcs_dem(
         url of wcs server, default is the Geoscience Australia DEM 1 arc second grid
     crs: str
         crs default 'EPSG:4326'
+    ntiles : tuple
+        number of tiles (nx, ny) to split the bbox into for concurrent download,
+        default (1, 1) downloads the bbox in a single request
+    wcs : WebCoverageService
+        existing WCS object for url, e.g. as used for get_capabilities(),
+        if None it is created (default None)
+    dtype : str
+        data type of output, 'float32' (default) or 'int16' with elevation rounded
+        to meters, which halves file size and read time of the DEM
+
+    The output file name contains a hash of bbox, resolution, crs and url.
+    Existing files are only reused if the updateSequence of the WCS capabilities
+    matches the one stored in the json sidecar file of the download.
+    If a native resolution download exists for the same bbox, other resolutions
+    are resampled locally from it instead of being downloaded again.
 
     Return
     ------
@@ -188,34 +813,62 @@ def getwcs_dem(
     if resolution is None:
         resolution = get_demdict()["resolution_arcsec"]
 
+    if dtype not in ["float32", "int16"]:
+        utils.msg_err(f"dtype {dtype} not supported. Choose either float32 or int16.")
+        return False
+
     os.makedirs(outpath, exist_ok=True)
     # Create WCS object and get data
     try:
-        with spin("Retrieving coverage from WCS server") as s:
-            wcs = WebCoverageService(url, version="1.0.0", timeout=300)
-            s(1)
+        if wcs is None:
+            with spin("Retrieving coverage from WCS server") as s:
+                wcs = _get_wcs(url)
+                s(1)
         layername = wcs["1"].title
-        date = datetime.now(timezone.utc).strftime("%Y_%m_%d")
-        fname_out = layername.replace(" ", "_") + "_" + date + ".tif"
+        update_sequence = getattr(wcs, "updateSequence", None)
+        fname_out = _dem_fname(layername, bbox, resolution, crs, url, dtype=dtype)
         outfname = os.path.join(outpath, fname_out)
-        if os.path.exists(outfname):
+        fname_native = _native_dem_path(outpath, layername, bbox, crs, url, dtype=dtype)
+        if _is_current(outfname, update_sequence):
             utils.msg_warn(f"{fname_out} already exists, skipping download")
             # logging.warning(f"△ | download skipped: {outfname} already exists")
-        else:
-            with spin(f"Downloading {fname_out}") as s:
-                data = wcs.getCoverage(
-                    identifier="1",
-                    bbox=bbox,
-                    format="GeoTIFF",
-                    crs=crs,
-                    resx=resolution / 3600,
-                    resy=resolution / 3600,
-                    Styles="tc",
+        elif _is_current(fname_native, update_sequence):
+            with spin(f"Resampling {fname_out} from native resolution DEM") as s:
+                # Resampling from native resolution is always downsampling
+                _warp_local(
+                    fname_native,
+                    outfname,
+                    crs,
+                    resolution / 3600,
+                    bounds=bbox,
+                    resampling="average",
                 )
                 s(1)
-            # Save data to file
-            with open(outfname, "wb") as f:
-                f.write(data.read())
+            if dtype == "int16":
+                _to_int16(outfname)
+            _to_cog(outfname)
+            _write_sidecar(outfname, update_sequence)
+        else:
+            fnames_tmp = []
+            try:
+                with spin(f"Downloading {fname_out}") as s:
+                    if tuple(ntiles) == (1, 1):
+                        _get_tile(url, bbox, resolution, crs, outfname, wcs=wcs)
+                        fname_src = outfname
+                    else:
+                        fname_src, fnames_tmp = _get_tiles(
+                            url, bbox, resolution, crs, outfname, ntiles
+                        )
+                    s(1)
+                if dtype == "int16":
+                    _to_int16(outfname, fname_src=fname_src)
+                    fname_src = outfname
+                _to_cog(outfname, fname_src=fname_src)
+            finally:
+                for fname in fnames_tmp:
+                    if os.path.exists(fname):
+                        os.remove(fname)
+            _write_sidecar(outfname, update_sequence)
             # logging.print(f"✓ | DEM downloaded to: {outfname}")
     except Exception as e:
         print(e)
@@ -249,20 +902,22 @@ def get_dem_layers(layernames, outpath, bbox, resolution=1, crs="EPSG:4326"):
     """
     outfnames = []
     dem_ok = False
+    fnames_slope_aspect = None
     for layername in layernames:
         if layername == "DEM":
             outfname = outfname_dem = getwcs_dem(outpath, bbox, resolution, crs=crs)
             dem_ok = True
-        elif layername == "Slope":
+        elif layername in ["Slope", "Aspect"]:
             if not dem_ok:
                 outfname_dem = getwcs_dem(outpath, bbox, resolution, crs=crs)
                 dem_ok = True
-            outfname = dem2slope(outfname_dem)
-        elif layername == "Aspect":
-            if not dem_ok:
-                outfname_dem = getwcs_dem(outpath, bbox, resolution, crs=crs)
-                dem_ok = True
-            outfname = dem2aspect(outfname_dem)
+            # Slope and aspect are computed together, so only do this once
+            if fnames_slope_aspect is None:
+                fnames_slope_aspect = dem2slope_aspect(outfname_dem)
+            if layername == "Slope":
+                outfname = fnames_slope_aspect[0]
+            else:
+                outfname = fnames_slope_aspect[1]
         else:
             utils.msg_warn(f"Layername {layername} not recognised, skipping")
             outfname = None
@@ -270,37 +925,211 @@ def get_dem_layers(layernames, outpath, bbox, resolution=1, crs="EPSG:4326"):
     return outfnames
 
 
-def plot_raster(infname):
+def plot_raster(infname, max_size=2048):
     """
-    Read in raster tif with rasterio and visualise as map
+    Read in raster tif with rasterio and visualise as map.
+    Large rasters are read decimated, which uses the matching overview level
+    if available instead of decoding every pixel.
 
     Parameters
     ----------
     infname : str
+    max_size : int
+        approximate maximum number of pixels along each axis to display
     """
-    data = rasterio.open(infname)
+    with rasterio.open(infname) as src:
+        oview = max(1, int(max(src.width, src.height) / max_size))
+        data = src.read(
+            1,
+            out_shape=(max(1, src.height // oview), max(1, src.width // oview)),
+            resampling=Resampling.average,
+            masked=True,
+        )
+        transform = src.transform * src.transform.scale(
+            src.width / data.shape[-1], src.height / data.shape[-2]
+        )
     # show image
-    show(data)
+    show(data, transform=transform)
 
 
-def dem2slope(fname_dem):
+@njit(
+    "void(float32[:, :], float64[:], float64, float32[:, :], float32[:, :])",
+    nogil=True,
+    cache=True,
+)
+def _horn(z, cx, cy, out_slope, out_aspect):
     """
-    Calculate slope from DEM and save as geotiff
+    Calculate slope and aspect with Horn's (1981) 3x3 method, same as gdaldem.
+    Border cells and cells with a NaN in their neighbourhood are left untouched,
+    flat cells get no aspect. Runs without the GIL, so blocks can be processed in threads.
+
+    Parameters
+    ----------
+    z : 2D array
+        elevation, nodata as NaN
+    cx : 1D array
+        cell size in x direction for each row (in units of z)
+    cy : float
+        cell size in y direction (in units of z)
+    out_slope : 2D array
+        output slope in degrees, same shape as z
+    out_aspect : 2D array
+        output aspect in degrees clockwise from north, same shape as z
+    """
+    nrows, ncols = z.shape
+    for i in range(1, nrows - 1):
+        for j in range(1, ncols - 1):
+            dzdx = (
+                (z[i - 1, j + 1] + 2 * z[i, j + 1] + z[i + 1, j + 1])
+                - (z[i - 1, j - 1] + 2 * z[i, j - 1] + z[i + 1, j - 1])
+            ) / (8 * cx[i])
+            dzdy = (
+                (z[i + 1, j - 1] + 2 * z[i + 1, j] + z[i + 1, j + 1])
+                - (z[i - 1, j - 1] + 2 * z[i - 1, j] + z[i - 1, j + 1])
+            ) / (8 * cy)
+            if np.isnan(z[i, j]) or np.isnan(dzdx) or np.isnan(dzdy):
+                continue
+            out_slope[i, j] = np.degrees(np.arctan(np.hypot(dzdx, dzdy)))
+            if dzdx == 0 and dzdy == 0:
+                continue
+            aspect = np.degrees(np.arctan2(dzdy, -dzdx))
+            if aspect > 90:
+                aspect = 450 - aspect
+            else:
+                aspect = 90 - aspect
+            if aspect == 360:
+                aspect = 0
+            out_aspect[i, j] = aspect
+
+
+def _get_cellsize(src):
+    """
+    Get cell size in meters for each row of a raster.
+    For geographic crs the longitudinal cell size depends on the latitude of the row.
+
+    Parameters
+    ----------
+    src : rasterio dataset
+
+    Return
+    ------
+    cx : 1D array, cell size in x direction for each row
+    cy : float, cell size in y direction
+    """
+    res_x, res_y = src.res
+    if src.crs is not None and src.crs.is_geographic:
+        lats = src.transform.f + (np.arange(src.height) + 0.5) * src.transform.e
+        cx = calc_arc2meter(res_x * 3600, lats)[0]
+        cy = calc_arc2meter(res_y * 3600, 0)[1]
+    else:
+        cx = np.full(src.height, res_x)
+        cy = res_y
+    return np.asarray(cx, dtype=np.float64), float(cy)
+
+
+def dem2slope_aspect(fname_dem, blocksize=512, max_workers=None):
+    """
+    Calculate slope and aspect from DEM in a single pass and save as geotiffs.
+
+    The DEM is processed in blocks, which are read with a one pixel halo for the
+    Horn stencil and distributed over a thread pool, so memory use is bounded by
+    block size times number of workers instead of the full raster.
+    Outputs are written as tiled geotiffs with the same block size.
 
     Parameters
     ----------
     fname_dem : str
         DEM path + file name
+    blocksize : int
+        block size in pixels, multiple of 16 (default 512)
+    max_workers : int
+        number of threads, default is the number of CPUs
+
+    Return
+    ------
+    fname_slope, fname_aspect : output filenames of slope and aspect
     """
     # Get filename
     fname = os.path.basename(fname_dem)
     # Get path for output
     path = os.path.dirname(fname_dem)
-    fname_out = os.path.join(path, "Slope_" + fname)
-    gdal.DEMProcessing(fname_out, fname_dem, "slope")
-    logging.info(f"✔  DEM slope from: {fname_dem}")
-    utils.msg_success(f"DEM slope generated at: {fname_out}")
-    return fname_out
+    fname_slope = os.path.join(path, "Slope_" + fname)
+    fname_aspect = os.path.join(path, "Aspect_" + fname)
+
+    with rasterio.open(fname_dem) as src:
+        height, width = src.height, src.width
+        cx, cy = _get_cellsize(src)
+        profile = src.profile
+    profile.update(
+        count=1,
+        dtype="float32",
+        nodata=_NODATA,
+        tiled=True,
+        blockxsize=blocksize,
+        blockysize=blocksize,
+    )
+    windows = [
+        Window(col, row, min(blocksize, width - col), min(blocksize, height - row))
+        for row in range(0, height, blocksize)
+        for col in range(0, width, blocksize)
+    ]
+
+    # rasterio datasets are not thread-safe, each worker reads with its own handle
+    thread_local = threading.local()
+    srcs_thread = []
+    write_lock = threading.Lock()
+
+    def _process(window):
+        src_thread = getattr(thread_local, "src", None)
+        if src_thread is None:
+            src_thread = thread_local.src = rasterio.open(fname_dem, sharing=False)
+            srcs_thread.append(src_thread)
+        # Expand window by one pixel halo, clamped to raster bounds
+        row0 = max(window.row_off - 1, 0)
+        col0 = max(window.col_off - 1, 0)
+        row1 = min(window.row_off + window.height + 1, height)
+        col1 = min(window.col_off + window.width + 1, width)
+        expanded = Window(col0, row0, col1 - col0, row1 - row0)
+        z = src_thread.read(1, window=expanded, masked=True)
+        z = z.astype(np.float32).filled(np.nan)
+        slope = np.full(z.shape, _NODATA, dtype=np.float32)
+        aspect = np.full(z.shape, _NODATA, dtype=np.float32)
+        _horn(z, cx[row0:row1], cy, slope, aspect)
+        # Remove halo
+        i0 = window.row_off - row0
+        j0 = window.col_off - col0
+        i1 = i0 + window.height
+        j1 = j0 + window.width
+        with write_lock:
+            dst_slope.write(slope[i0:i1, j0:j1], 1, window=window)
+            dst_aspect.write(aspect[i0:i1, j0:j1], 1, window=window)
+
+    try:
+        with rasterio.open(fname_slope, "w", **profile) as dst_slope, rasterio.open(
+            fname_aspect, "w", **profile
+        ) as dst_aspect:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for _ in executor.map(_process, windows):
+                    pass
+    finally:
+        for src_thread in srcs_thread:
+            src_thread.close()
+    logging.info(f"✔  DEM slope and aspect from: {fname_dem}")
+    utils.msg_success(f"DEM slope generated at: {fname_slope}")
+    utils.msg_success(f"Aspect (from DEM) generated at: {fname_aspect}")
+    return fname_slope, fname_aspect
+
+
+def dem2slope(fname_dem):
+    """
+    Calculate slope from DEM and save as geotiff
+
+    Parameters
+    ----------
+    fname_dem : str
+        DEM path + file name
+    """
+    return dem2slope_aspect(fname_dem)[0]
 
 
 def dem2aspect(fname_dem):
@@ -312,15 +1141,7 @@ def dem2aspect(fname_dem):
     fname_dem : str
         DEM file name
     """
-    # Get filename
-    fname = os.path.basename(fname_dem)
-    # Get path for output
-    path = os.path.dirname(fname_dem)
-    fname_out = os.path.join(path, "Aspect_" + fname)
-    gdal.DEMProcessing(fname_out, fname_dem, "aspect")
-    logging.info(f"✓ | DEM aspect from: {fname_dem}")
-    utils.msg_success(f"Aspect (from DEM) generated at: {fname_out}")
-    return fname_out
+    return dem2slope_aspect(fname_dem)[1]
 
 
 def test_getwcs_dem(outpath="./test_DEM/"):
@@ -329,16 +1150,18 @@ def test_getwcs_dem(outpath="./test_DEM/"):
     """
     bbox = (114, -44, 153.9, -11)
     resolution = 100
-    url = "https://services.ga.gov.au/site_9/services/DEM_SRTM_1Second_Hydro_Enforced/MapServer/WCSServer?request=GetCapabilities&service=WCS"
+    url = _DEFAULT_DEM_URL
     crs = "EPSG:4326"
-    # get capabilities
-    keys, title_list, description_list, bbox_list = get_capabilities(url)
-    # get data
-    print("Retrieving data from Geoscience Australia DEM 1 arc second grid...")
-    outfname = getwcs_dem(outpath, bbox, resolution, url, crs)
-    # Convert to slope and aspect
-    print("Convert to slope and aspect...")
-    dem2slope(outfname)
-    dem2aspect(outfname)
-    # plot DEM
-    plot_raster(outfname)
+    # get capabilities, the same WCS object is reused for the download
+    wcs = _get_wcs(url)
+    keys, title_list, description_list, bbox_list = get_capabilities(url, wcs=wcs)
+    # Larger GDAL block cache so that repeated reads of the DEM hit warm blocks
+    with rasterio.Env(GDAL_CACHEMAX=512):
+        # get data
+        print("Retrieving data from Geoscience Australia DEM 1 arc second grid...")
+        outfname = getwcs_dem(outpath, bbox, resolution, url, crs, wcs=wcs)
+        # Convert to slope and aspect
+        print("Convert to slope and aspect...")
+        dem2slope_aspect(outfname)
+        # plot DEM
+        plot_raster(outfname)